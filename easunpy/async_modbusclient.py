@@ -189,6 +189,12 @@ class AsyncModbusClient:
         self._active_connections.add(writer)
         logger.info("Client connection established")
 
+    async def _read_frame(self) -> bytes:
+        """Read one Modbus TCP frame using the length from its header."""
+        header = await self._reader.readexactly(6)
+        length = int.from_bytes(header[4:6], 'big')
+        return header + await self._reader.readexactly(length)
+
     async def send_bulk(self, hex_commands: list[str], retry_count: int = 5) -> list[str]:
         """Send multiple Modbus TCP commands using persistent connection."""
         async with self._lock:
@@ -215,14 +221,7 @@ class AsyncModbusClient:
                             self._writer.write(command_bytes)
                             await self._writer.drain()
 
-                            response = await asyncio.wait_for(self._reader.read(1024), timeout=5)
-                            if len(response) >= 6:
-                                expected_length = int.from_bytes(response[4:6], 'big') + 6
-                                while len(response) < expected_length:
-                                    chunk = await asyncio.wait_for(self._reader.read(1024), timeout=5)
-                                    if not chunk:
-                                        break
-                                    response += chunk
+                            response = await asyncio.wait_for(self._read_frame(), timeout=5)
 
                             logger.debug(f"Response: {response.hex()}")
                             responses.append(response.hex())
@@ -1,6 +1,6 @@
 import logging
-from typing import List, Optional
-from .modbusclient import ModbusClient, create_request, decode_modbus_response
+from typing import List, Optional, Tuple
+from .modbusclient import ModbusClient, decode_modbus_response
 from easunpy.models import BatteryData, PVData, GridData, OutputData, OperatingMode, SystemStatus
 
 # Set up logging
@@ -9,19 +9,31 @@ logger = logging.getLogger(__name__)
 class ISolar:
     def __init__(self, inverter_ip: str, local_ip: str):
         self.client = ModbusClient(inverter_ip=inverter_ip, local_ip=local_ip)
+        self._transaction_id = 0x0777
+
+    def close(self):
+        """Close the connection to the inverter and release the local port."""
+        self.client.close()
+
+    def _get_next_transaction_id(self) -> int:
+        """Get next transaction ID and increment counter."""
+        current_id = self._transaction_id
+        self._transaction_id = (self._transaction_id + 1) & 0xFFFF  # Wrap around at 0xFFFF
+        return current_id
 
     def _read_registers(self, start_register: int, count: int, data_format: str = "Int") -> List[int]:
         """Read a sequence of registers."""
         try:
-            request = create_request(0x0777, 0x0001, 0x01, 0x03, start_register, count)
-            logger.debug(f"Sending request for registers {start_register}-{start_register + count - 1}: {request}")
+            request = self.client.build_request(self._get_next_transaction_id(), 0x0001, 0x01, 0x03, start_register, count)
+            logger.debug(f"Sending request for registers {start_register}-{start_register + count - 1}")
             
             response = self.client.send(request)
             if not response:
                 logger.warning(f"No response received for registers {start_register}-{start_register + count - 1}")
                 return []
             
-            logger.debug(f"Received response: {response}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received response: %s", response.hex())
             decoded = decode_modbus_response(response, count, data_format)
             logger.debug(f"Decoded values: {decoded}")
             return decoded
@@ -29,6 +41,30 @@ class ISolar:
             logger.error(f"Error reading registers {start_register}-{start_register + count - 1}: {str(e)}")
             return []
 
+    def _read_register_groups(self, register_groups: List[Tuple[int, int]], data_format: str = "Int") -> List[List[int]]:
+        """Read several register groups in a single round trip."""
+        try:
+            requests = [
+                self.client.build_request(self._get_next_transaction_id(), 0x0001, 0x01, 0x03, start, count)
+                for start, count in register_groups
+            ]
+            logger.debug(f"Sending requests for register groups {register_groups}")
+
+            responses = self.client.send_many(requests)
+
+            decoded_groups = []
+            for response, (start, count) in zip(responses, register_groups):
+                if not response:
+                    logger.warning(f"No response received for registers {start}-{start + count - 1}")
+                    decoded_groups.append([])
+                    continue
+                decoded_groups.append(decode_modbus_response(response, count, data_format))
+            logger.debug(f"Decoded values: {decoded_groups}")
+            return decoded_groups
+        except Exception as e:
+            logger.error(f"Error reading register groups {register_groups}: {str(e)}")
+            return [[] for _ in register_groups]
+
     def get_battery_data(self) -> Optional[BatteryData]:
         """Get battery information (registers 277-281)."""
         values = self._read_registers(277, 5)
@@ -45,15 +81,13 @@ class ISolar:
 
     def get_pv_data(self) -> Optional[PVData]:
         """Get PV information (combines multiple register groups)."""
-        pv_general = self._read_registers(302, 4)
+        pv_general, pv1_data, pv2_data = self._read_register_groups([(302, 4), (346, 8), (389, 3)])
         if not pv_general or len(pv_general) != 4:
             return None
 
-        pv1_data = self._read_registers(346, 8)
         if not pv1_data or len(pv1_data) != 8:
             return None
 
-        pv2_data = self._read_registers(389, 3)
         if not pv2_data or len(pv2_data) != 3:
             return None
 
@@ -76,13 +110,11 @@ class ISolar:
         # Register 340: Grid power
         # Register 607: Grid frequency (50.00Hz = 5000)
         
-        # Read grid voltage and power
-        values = self._read_registers(338, 3)
+        # Read grid voltage and power, and frequency from correct register
+        values, freq = self._read_register_groups([(338, 3), (607, 1)])
         if not values or len(values) != 3:
             return None
         
-        # Read frequency from correct register
-        freq = self._read_registers(607, 1)
         if not freq:
             return None
 
@@ -101,13 +133,11 @@ class ISolar:
         # Register 350: Load percentage
         # Register 607: Output frequency (50.00Hz = 5000)
         
-        # Read output parameters
-        values = self._read_registers(346, 5)
+        # Read output parameters, and frequency from correct register
+        values, freq = self._read_register_groups([(346, 5), (607, 1)])
         if not values or len(values) != 5:
             return None
         
-        # Read frequency from correct register
-        freq = self._read_registers(607, 1)
         if not freq:
             return None
 
@@ -1,194 +1,330 @@
 import socket
+import random
 import struct
 import time
 import logging  # Import logging
+from functools import lru_cache
+from typing import List, Union
 
 from easunpy.crc import crc16_modbus
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Longitud en la cabecera TCP, y trama más larga: cabecera (6) + FF04 (2) + trama RTU (256)
+_LENGTH = struct.Struct('>H')
+_MAX_FRAME_SIZE = 6 + 2 + 256
+
+# Cabecera TCP + campo `FF04` + paquete RTU sin CRC, seguido del CRC
+_REQUEST = struct.Struct('>HHHBBBBHH')
+_RTU_PACKET = struct.Struct('>BBHH')
+_CRC = struct.Struct('<H')
+# Longitud: FF04 + paquete RTU + CRC
+_REQUEST_LENGTH = 2 + _RTU_PACKET.size + _CRC.size
+_REQUEST_SIZE = _REQUEST.size + _CRC.size
+
 class ModbusClient:
-    def __init__(self, inverter_ip: str, local_ip: str, port: int = 8899):
+    """
+    Modbus client for one inverter. The inverter connects back to
+    `local_ip:port`, so each inverter needs its own local port.
+    """
+    def __init__(self, inverter_ip: str, local_ip: str, port: int = 8899, timeout: float = 5):
         self.inverter_ip = inverter_ip
         self.local_ip = local_ip
         self.port = port
+        self.timeout = timeout
         self.request_id = 0  # Add request ID counter
+        self._listen_sock = None  # Persistent TCP listener
+        self._client_sock = None  # Connection accepted from the inverter
+        self._udp_sock = None  # Reused for every UDP discovery
+        self._udp_payload = f"set>server={local_ip}:{port};".encode()
+        self._udp_addr = (inverter_ip, 58899)
+        self._req_buf = bytearray(_REQUEST_SIZE)  # Scratch buffer for build_request
+        self._rx = bytearray(_MAX_FRAME_SIZE)  # Receive buffer reused for every response
+        self._rx_view = memoryview(self._rx)
+
+    def build_request(self, transaction_id: int, protocol_id: int, unit_id: int, function_code: int,
+                      register_address: int, register_offset: int) -> bytes:
+        """Build a raw Modbus command in the client's scratch buffer (see `easunpy.modbusclient.build_request`)."""
+        _pack_request_into(self._req_buf, transaction_id, protocol_id, unit_id, function_code,
+                           register_address, register_offset)
+        return bytes(self._req_buf)
 
     def send_udp_discovery(self) -> bool:
         """Perform UDP discovery to initialize the inverter communication."""
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_sock:
-            udp_message = f"set>server={self.local_ip}:{self.port};"
+        try:
+            if self._udp_sock is None:
+                self._udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._udp_sock.settimeout(1.0)
+            logger.debug("Sending UDP discovery message to %s:58899", self.inverter_ip)
+            self._udp_sock.sendto(self._udp_payload, self._udp_addr)
+            self._udp_sock.recvfrom(1024)
+            return True
+        except socket.timeout:
+            logger.error("UDP discovery timed out")
+            return False
+        except Exception as e:
+            logger.error("Error sending UDP discovery message: %s", e)
+            return False
+
+    def _get_listen_socket(self) -> socket.socket:
+        """Return the TCP listener, binding it on first use."""
+        if self._listen_sock is None:
+            tcp_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             try:
-                logger.debug(f"Sending UDP discovery message to {self.inverter_ip}:58899")
-                udp_sock.sendto(udp_message.encode(), (self.inverter_ip, 58899))
-                response, _ = udp_sock.recvfrom(1024)
-                return True
-            except socket.timeout:
-                logger.error("UDP discovery timed out")
-                return False
-            except Exception as e:
-                logger.error(f"Error sending UDP discovery message: {e}")
-                return False
+                # No SO_REUSEPORT: a second client on the same port must fail to bind
+                # rather than compete for another inverter's connections
+                tcp_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+                logger.debug("Binding to %s:%s", self.local_ip, self.port)
+                tcp_server.bind((self.local_ip, self.port))
+                tcp_server.listen(1)
+            except Exception:
+                tcp_server.close()
+                raise
+            self._listen_sock = tcp_server
+        return self._listen_sock
+
+    def _connect(self) -> bool:
+        """Run UDP discovery and wait for the inverter to connect back."""
+        if not self.send_udp_discovery():
+            logger.info("UDP discovery failed")
+            return False
 
-    def send(self, hex_command: str, retry_count: int = 2) -> str:
-        """Send a Modbus TCP command."""
-        command_bytes = bytes.fromhex(hex_command)
-        logger.info(f"Sending command: {hex_command}")
+        tcp_server = self._get_listen_socket()
+        logger.debug("Waiting for client connection...")
+        # Only accept the inverter this client talks to
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("Timed out waiting for the inverter to connect")
+            tcp_server.settimeout(remaining)
+            client_sock, addr = tcp_server.accept()
+            if addr[0] == self.inverter_ip:
+                break
+            logger.warning("Ignoring connection from %s, expected inverter %s", addr[0], self.inverter_ip)
+            client_sock.close()
 
+        client_sock.settimeout(self.timeout)
+        # Commands are tiny; don't let Nagle hold them back waiting for an ACK
+        client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.info("Client connected from %s", addr)
+        self._client_sock = client_sock
+        return True
+
+    def _disconnect(self, abort: bool = False):
+        """
+        Drop the inverter connection so the next send runs discovery again.
+        With `abort`, reset the connection instead of closing it gracefully.
+        """
+        if self._client_sock is not None:
+            try:
+                if abort:
+                    self._client_sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                self._client_sock.close()
+            except OSError as e:
+                logger.debug("Error closing client connection: %s", e)
+            self._client_sock = None
+
+    def close(self):
+        """Close the inverter connection and the TCP listener."""
+        self._disconnect()
+        if self._listen_sock is not None:
+            self._listen_sock.close()
+            self._listen_sock = None
+        if self._udp_sock is not None:
+            self._udp_sock.close()
+            self._udp_sock = None
+
+    def _peer_closed(self) -> bool:
+        """Check, without blocking, whether the inverter closed or reset the idle connection."""
+        client_sock = self._client_sock
+        if client_sock.fileno() == -1:
+            return True  # Closed locally
+        client_sock.settimeout(0)
+        try:
+            return not client_sock.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return False  # Nothing pending, the connection is still open
+        except OSError:
+            return True
+        finally:
+            client_sock.settimeout(self.timeout)
+
+    def _recv_into(self, client_sock: socket.socket, view: memoryview):
+        """Fill `view` completely, usually in a single recv_into call."""
+        size = len(view)
+        received = client_sock.recv_into(view, size, socket.MSG_WAITALL)
+        while received < size:
+            # MSG_WAITALL may return early on sockets with a timeout set
+            count = client_sock.recv_into(view[received:])
+            if not count:
+                raise ConnectionResetError("Connection closed by inverter")
+            received += count
+
+    def _transact(self, commands: List[bytes], retry_count: int) -> list:
+        """
+        Send `commands` in one write and read one response frame per command,
+        retrying on failure. A frame with an unknown transaction ID means the
+        connection is out of sync, so it is treated as an error.
+        """
+        command_bytes = b"".join(commands)
+        transaction_ids = {command[:2] for command in commands}
+        backoff = 0.05
         for attempt in range(retry_count):
-            logger.debug(f"Attempt {attempt + 1} of {retry_count}")
-            
-            if not self.send_udp_discovery():
-                logger.info("UDP discovery failed")
-                time.sleep(1)
-                continue
-
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_server:
-                tcp_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                tcp_server.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
-                
-                try:
-                    # Attempt to bind to the local IP and port
-                    logger.debug(f"Binding to {self.local_ip}:{self.port}")
-                    tcp_server.bind((self.local_ip, self.port))
-                    tcp_server.listen(1)
-
-                    logger.debug("Waiting for client connection...")
-                    client_sock, addr = tcp_server.accept()
-                    logger.info(f"Client connected from {addr}")
-                    
-                    with client_sock:
-                        logger.debug("Sending command bytes...")
-                        client_sock.sendall(command_bytes)
-
-                        logger.debug("Waiting for response...")
-                        response = client_sock.recv(1024)
-                        
-                        if len(response) >= 6:
-                            expected_length = int.from_bytes(response[4:6], 'big') + 6
-                            
-                            while len(response) < expected_length:
-                                chunk = client_sock.recv(1024)
-                                if not chunk:
-                                    break
-                                response += chunk
-
-                        response_hex = response.hex()
-                        logger.info(f"Received response: {response_hex}")
-                        return response_hex
-
-                except socket.timeout:
-                    logger.info("Socket timeout")
-                    time.sleep(1)
-                    continue
-                except Exception as e:
-                    logger.error(f"Error: {str(e)}")
-                    time.sleep(1)
+            if attempt:
+                # Exponential backoff with a little jitter, capped at 1 second
+                time.sleep(backoff + random.random() * 0.02)
+                backoff = min(backoff * 2, 1.0)
+            logger.debug("Attempt %d of %d", attempt + 1, retry_count)
+
+            try:
+                if self._client_sock is not None and self._peer_closed():
+                    logger.debug("Inverter closed the idle connection, reconnecting")
+                    self._disconnect()
+                if self._client_sock is None and not self._connect():
                     continue
 
+                client_sock = self._client_sock
+                logger.debug("Sending command bytes...")
+                client_sock.sendall(command_bytes)
+
+                logger.debug("Waiting for response...")
+                responses = []
+                for _ in commands:
+                    self._recv_into(client_sock, self._rx_view[:6])
+                    length = _LENGTH.unpack_from(self._rx, 4)[0]
+                    if length > _MAX_FRAME_SIZE - 6:
+                        raise ValueError(f"Response length {length} exceeds maximum frame size")
+                    self._recv_into(client_sock, self._rx_view[6:6 + length])
+                    response = bytes(self._rx_view[:6 + length])
+                    if response[:2] not in transaction_ids:
+                        raise ValueError(f"Unexpected transaction ID in response: {response[:2].hex()}")
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info("Received response: %s", response.hex())
+                    responses.append(response)
+                return responses
+
+            except socket.timeout:
+                logger.info("Socket timeout")
+                self._disconnect(abort=True)
+            except Exception as e:
+                logger.error("Error: %s", e)
+                self._disconnect(abort=True)
+
         logger.info("All retry attempts failed")
-        return ""
+        return []
+
+    def send(self, command: Union[bytes, str], retry_count: int = 2) -> bytes:
+        """Send a Modbus TCP command (raw bytes or a hexadecimal string), reusing the inverter connection when possible."""
+        if isinstance(command, str):
+            command = bytes.fromhex(command)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Sending command: %s", command.hex())
+        responses = self._transact([command], retry_count)
+        return responses[0] if responses else b""
+
+    def send_many(self, commands: List[Union[bytes, str]], retry_count: int = 2) -> List[bytes]:
+        """
+        Send several Modbus TCP commands back to back in a single round trip.
+        Commands must use distinct transaction IDs; responses are matched by
+        transaction ID and returned in command order (b"" when missing).
+        """
+        commands = [bytes.fromhex(command) if isinstance(command, str) else command for command in commands]
+        if len({command[:2] for command in commands}) != len(commands):
+            raise ValueError("Commands sent together must use distinct transaction IDs")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Sending %d commands: %s", len(commands), [command.hex() for command in commands])
+        responses = self._transact(commands, retry_count)
 
-def run_single_request(inverter_ip: str, local_ip: str, request: str):
+        by_transaction_id = {response[:2]: response for response in responses}
+        return [by_transaction_id.get(command[:2], b"") for command in commands]
+
+def run_single_request(inverter_ip: str, local_ip: str, request: Union[bytes, str]) -> bytes:
     """
     Sends a single Modbus request to the inverter.
     """
     inverter = ModbusClient(inverter_ip=inverter_ip, local_ip=local_ip)
-    response = inverter.send(request)
-    return response
+    try:
+        return inverter.send(request)
+    finally:
+        inverter.close()
+
+@lru_cache(maxsize=256)
+def _rtu_crc(unit_id: int, function_code: int, register_address: int, register_offset: int) -> int:
+    """CRC of the RTU packet, cached because polling repeats the same few packets."""
+    return crc16_modbus(_RTU_PACKET.pack(unit_id, function_code, register_address, register_offset))
+
+def _pack_request_into(buffer, transaction_id: int, protocol_id: int, unit_id: int, function_code: int,
+                       register_address: int, register_offset: int):
+    """Write a complete Modbus command into the first `_REQUEST_SIZE` bytes of `buffer`."""
+    _REQUEST.pack_into(buffer, 0, transaction_id, protocol_id, _REQUEST_LENGTH, 0xFF, 0x04,
+                       unit_id, function_code, register_address, register_offset)
+    _CRC.pack_into(buffer, _REQUEST.size, _rtu_crc(unit_id, function_code, register_address, register_offset))
+
+def build_request(transaction_id: int, protocol_id: int, unit_id: int, function_code: int,
+                  register_address: int, register_offset: int) -> bytes:
+    """
+    Build a raw Modbus command with the correct length and CRC for the RTU packet.
+    """
+    return (_REQUEST.pack(transaction_id, protocol_id, _REQUEST_LENGTH, 0xFF, 0x04,
+                          unit_id, function_code, register_address, register_offset)
+            + _CRC.pack(_rtu_crc(unit_id, function_code, register_address, register_offset)))
 
 # Función para crear la solicitud completa
 def create_request(transaction_id: int, protocol_id: int, unit_id: int, function_code: int,
                    register_address: int, register_offset: int) -> str:
     """
-    Create a Modbus command with the correct length and CRC for the RTU packet.
+    Create a Modbus command as a hexadecimal string (see `build_request`).
     """
-    # Construir el paquete RTU
-    rtu_packet = bytearray([
-        unit_id,
-        function_code,
-        (register_address >> 8) & 0xFF, register_address & 0xFF,
-        (register_offset >> 8) & 0xFF, register_offset & 0xFF
-    ])
-
-    # Calcular el CRC para el paquete RTU
-    crc = crc16_modbus(rtu_packet)
-    crc_low = crc & 0xFF
-    crc_high = (crc >> 8) & 0xFF
-
-    # Agregar CRC al paquete RTU
-    rtu_packet.extend([crc_low, crc_high])
-    
-    # Campo adicional `FF04`
-    rtu_packet = bytearray([0xFF, 0x04]) + rtu_packet
-    
-    # Calcular la longitud total (incluye solo RTU) + TCP
-    length = len(rtu_packet)
-    
-    # Construir el comando completo
-    command = bytearray([
-        (transaction_id >> 8) & 0xFF, transaction_id & 0xFF,  # Transaction ID
-        (protocol_id >> 8) & 0xFF, protocol_id & 0xFF,        # Protocol ID
-        (length >> 8) & 0xFF, length & 0xFF                  # Longitud
-    ]) + rtu_packet
-
-    return command.hex()
-
-def decode_modbus_response(response: str, register_count: int=1, data_format: str="Int"):
+    return build_request(transaction_id, protocol_id, unit_id, function_code,
+                         register_address, register_offset).hex()
+
+# Formato struct de un registro de 16 bits para cada `data_format`
+_REGISTER_FORMATS = {
+    "Int": "h",          # Signed 16-bit integer
+    "UnsignedInt": "H",  # Unsigned 16-bit integer (0 to 65535)
+}
+
+@lru_cache(maxsize=128)
+def _register_struct(data_format: str, register_count: int) -> struct.Struct:
+    """Compiled struct for `register_count` registers in `data_format`, cached per pair."""
+    try:
+        register_format = _REGISTER_FORMATS[data_format]
+    except KeyError:
+        raise ValueError(f"Unsupported data format: {data_format}") from None
+    return struct.Struct(f">{register_count}{register_format}")
+
+def decode_modbus_response(response: Union[bytes, str], register_count: int=1, data_format: str="Int"):
     """
     Decodes a Modbus TCP response using the provided format.
-    :param request: Hexadecimal string of the Modbus request.
-    :param response: Hexadecimal string of the Modbus response.
-    :return: Dictionary with register addresses and their values.
+    :param response: Raw Modbus response (a hexadecimal string is also accepted).
+    :return: List of register values.
     """
-    # Extract common fields from response
-    req_id = response[:8]
-    length_hex = response[8:12]
-    length = int(length_hex, 16)
-    
-    # Extract RTU payload
-    rtu_payload = response[12:12 + length * 2]
-
-    # Decode RTU Payload
-    extra_field = rtu_payload[:2]
-    device_address = rtu_payload[2:4]
-    function_code = rtu_payload[4:6]
-    num_data_bytes = int(rtu_payload[8:10], 16)
-    data_bytes = rtu_payload[10:10 + num_data_bytes * 2]
-    # Decode the register values and pair with addresses
-    values = []
-    for i, _ in enumerate(range(register_count)):
-        if data_format == "Int":
-            # Handle signed 16-bit integers
-            value = int(data_bytes[i * 4:(i + 1) * 4], 16)
-            # If the highest bit is set (value >= 32768), it's negative
-            if value >= 32768:  # 0x8000
-                value -= 65536  # 0x10000
-        elif data_format == "UnsignedInt":
-            # Handle unsigned 16-bit integers (0 to 65535)
-            value = int(data_bytes[i * 4:(i + 1) * 4], 16)
-        elif data_format == "Float":
-            value = struct.unpack('f', bytes.fromhex(data_bytes[i * 4:(i + 1) * 4]))[0]
-        else:
-            raise ValueError(f"Unsupported data format: {data_format}")
-        values.append(value)
-
-    return values
-
-def get_registers_from_request(request: str) -> list:
+    if isinstance(response, str):
+        response = bytes.fromhex(response)
+
+    # TCP header (6) + FF04 (2) + device address (1) + function code (1)
+    num_data_bytes = response[10]
+    if register_count * 2 > num_data_bytes:
+        raise ValueError(f"Response holds {num_data_bytes // 2} registers, expected {register_count}")
+
+    # Decode all register values in a single unpack call
+    values = _register_struct(data_format, register_count).unpack_from(response, 11)
+
+    return list(values)
+
+def get_registers_from_request(request: Union[bytes, str]) -> list:
     """
     Extracts register addresses from a Modbus request
-    :param request: Hexadecimal string of the Modbus request
+    :param request: Raw Modbus request (a hexadecimal string is also accepted)
     :return: List of register addresses
     """
-    rtu_payload = request[12:]  # Skip TCP header
-    register_address = int(rtu_payload[8:12], 16)  # Get register address from RTU payload
-    register_count = int(rtu_payload[12:16], 16)  # Get number of registers
-    
-    registers = []
-    for i in range(register_count):
-        registers.append(register_address + i)
-        
-    return registers
+    if isinstance(request, str):
+        request = bytes.fromhex(request)
+
+    # Register address and count follow the TCP header, FF04, device address and function code
+    register_address, register_count = struct.unpack_from('>HH', request, 10)
+
+    return list(range(register_address, register_address + register_count))